@@ -42,13 +42,14 @@ Original file is located at
 # =============================================================================
 
 import os
+import io
 import math
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import zipfile
 import shutil
 
-from scipy import stats
 from matplotlib.lines import Line2D
 from datetime import datetime
 
@@ -71,7 +72,7 @@ SINGLE_SCENARIO_INDEX = 0  # Index of scenario to run if RUN_SINGLE = True
 # --- Display Settings ---
 POP_MIN = 1             # Minimum population size to display on the graph
 POP_MAX = 250           # Maximum population size to display on the graph
-# POP_MAX_ALL = 20000   # Total population size range used in calculations (not displayed)
+POP_MAX_ALL = 20000     # Total population size range used in calculations (not displayed)
 SAMPLE_CAP = 30         # Maximum sample size shown on the graph
 
 X_TICK_START = 0        # Starting point for x-axis ticks
@@ -80,6 +81,12 @@ X_TICK_INTERVAL = 10    # Interval between x-axis ticks
 Y_TICK_START = 0        # Starting point for y-axis ticks
 Y_TICK_INTERVAL = 5     # Interval between y-axis ticks
 
+# Tick positions derived from the settings above, shared by every graph
+X_TICKS = list(range(X_TICK_START, POP_MAX + 1, X_TICK_INTERVAL))
+Y_TICKS = list(range(Y_TICK_START, SAMPLE_CAP + 1, Y_TICK_INTERVAL))
+
+GRAPH_DPI = 150         # Resolution of saved graphs (embedded in Excel at 80% scale)
+
 OUTPUT_DIR = "/content/"
 
 # --- Date/Time Format Settings ---
@@ -148,6 +155,20 @@ SCENARIOS = [
 if len(SCENARIOS) > 26:
     print("⚠️ Warning: More than 26 scenarios. Letters will repeat after Z.")
 
+# --- Confidence Level Lookup ---
+# Confidence depends only on the Z-score, so it is computed once per unique Z
+confidence_cache = {}
+
+def norm_cdf(z):
+    """Standard normal CDF, computed with math.erf."""
+    return 0.5 * (1.0 + math.erf(z / math.sqrt(2.0)))
+
+def calculate_confidence(z):
+    """Return the two-sided confidence level for a Z-score, cached by Z."""
+    if z not in confidence_cache:
+        confidence_cache[z] = round(2 * norm_cdf(z) - 1, 4)
+    return confidence_cache[z]
+
 # --- Dynamically Generate Scenario Names and Properties ---
 for idx, scenario in enumerate(SCENARIOS):
     # Validate Z-score
@@ -163,7 +184,7 @@ for idx, scenario in enumerate(SCENARIOS):
         raise ValueError(f"Scenario {idx+1}: Proportion must be between 0 and 1")
 
     # Calculate confidence level from Z-score
-    confidence = round(2 * stats.norm.cdf(scenario["Z"]) - 1, 4)
+    confidence = calculate_confidence(scenario["Z"])
     confidence_pct = round(confidence * 100, 1)
     margin_pct = round(scenario['Margin'] * 100, 1)
 
@@ -182,6 +203,22 @@ for idx, scenario in enumerate(SCENARIOS):
 # SECTION 3: Sample Size Calculation Function and Helpers
 # =============================================================================
 
+def calculate_initial_sample_size(e, p, z):
+    """
+    Calculate the initial sample size n_0 for an infinite population.
+
+    n_0 depends only on the scenario parameters, so it is computed once per
+    scenario and reused for every population size.
+
+    Parameters:
+    e: Margin of error (decimal form)
+    p: Expected proportion (typically 0.5)
+    z: Z-score for desired confidence level
+    """
+    numerator = (z ** 2) * p * (1 - p)
+    denominator = e ** 2
+    return numerator / denominator
+
 def calculate_sample_size(N, e, p, z):
     """
     Calculate sample size with finite population correction.
@@ -195,12 +232,67 @@ def calculate_sample_size(N, e, p, z):
     if N < 1:
         raise ValueError("Population must be >= 1")
 
-    numerator = (z ** 2) * p * (1 - p)
-    denominator = e ** 2
-    n_0 = numerator / denominator
+    n_0 = calculate_initial_sample_size(e, p, z)
     adjusted_n = n_0 / (1 + ((n_0 - 1) / N))
     return min(math.ceil(adjusted_n), N)
 
+def calculate_sample_sizes(N, n_0):
+    """
+    Vectorized finite population correction for an array of population sizes.
+
+    Parameters:
+    N: NumPy array of population sizes (all >= 1)
+    n_0: Initial sample size from calculate_initial_sample_size
+
+    Returns:
+    NumPy int32 array of sample sizes, one per population size
+    """
+    N = np.asarray(N, dtype=np.float64)
+    if (N < 1).any():
+        raise ValueError("Population must be >= 1")
+
+    adjusted_n = n_0 / (1 + ((n_0 - 1) / N))
+    return np.minimum(np.ceil(adjusted_n).astype(np.int32), N.astype(np.int32))
+
+def calculate_sample_size_ranges(n_0, pop_max):
+    """
+    Calculate the population range covered by each sample size directly,
+    without evaluating every population size from 1 to pop_max.
+
+    The corrected sample size never decreases as N grows, so the largest
+    population needing at most s records solves n_0 / (1 + ((n_0 - 1) / N)) <= s,
+    which gives N <= s * (n_0 - 1) / (n_0 - s).
+
+    Parameters:
+    n_0: Initial sample size from calculate_initial_sample_size
+    pop_max: Largest population size in the table
+
+    Returns:
+    DataFrame with Sample_Size and the min and max population for each size
+    """
+    largest_sample = int(calculate_sample_sizes(pop_max, n_0))
+    sample_sizes = np.arange(1, largest_sample + 1, dtype=np.int32)
+
+    # Closed-form upper bound for every sample size below the largest one
+    below = sample_sizes[:-1]
+    range_max = np.full(largest_sample, pop_max, dtype=np.int32)
+    range_max[:-1] = np.clip(np.floor(below * (n_0 - 1) / (n_0 - below)), 1, pop_max)
+
+    # Nudge the closed-form boundaries onto the exact formula so the ranges
+    # agree with calculate_sample_size at every population size
+    range_max -= (range_max > 1) & (calculate_sample_sizes(range_max, n_0) > sample_sizes)
+    range_max += (range_max < pop_max) & (calculate_sample_sizes(range_max + 1, n_0) <= sample_sizes)
+
+    # Each range starts right after the previous one ends; drop empty ranges
+    range_min = np.concatenate(([1], range_max[:-1] + 1))
+    non_empty = range_max >= range_min
+
+    return pd.DataFrame({
+        "Sample_Size": sample_sizes[non_empty],
+        "min": range_min[non_empty],
+        "max": range_max[non_empty],
+    })
+
 def test_sample_size_calculation():
     """Test function to verify calculations are working correctly."""
     test_cases = [
@@ -512,9 +604,13 @@ print(f"▶ Created output folder: {output_folder_name}")
 # =============================================================================
 
 scenarios_to_run = [SCENARIOS[SINGLE_SCENARIO_INDEX]] if RUN_SINGLE else SCENARIOS
-plot_df = pd.DataFrame()
+plot_frames = []
 scenario_summary = []
 
+# Only the graphed population sizes need a per-size evaluation; the tables
+# come from calculate_sample_size_ranges. Built once and shared by all scenarios.
+population_sizes = np.arange(max(POP_MIN, 1), min(POP_MAX, POP_MAX_ALL) + 1, dtype=np.int32)
+
 print("Starting sample size calculations...\n")
 
 for scenario in scenarios_to_run:
@@ -527,18 +623,21 @@ for scenario in scenarios_to_run:
 
     print(f"▶ Processing {name}...")
 
-    # Generate full sample size dataset
+    # Initial sample size depends only on the scenario parameters
+    n_0 = calculate_initial_sample_size(e, p, z)
+
+    # Sample sizes for the graphed population range (int32, like the populations)
     df = pd.DataFrame({
-        "Population_Size": range(1, 20001)
+        "Population_Size": population_sizes,
+        "Sample_Size": calculate_sample_sizes(population_sizes, n_0)
     })
-    df["Sample_Size"] = df["Population_Size"].apply(lambda N: calculate_sample_size(N, e, p, z))
-    df["Truncated_Sample_Size"] = df["Sample_Size"].apply(lambda x: min(x, SAMPLE_CAP))
 
-    # Group population ranges by sample size
-    grouped = df.groupby("Sample_Size")["Population_Size"].agg(["min", "max"]).reset_index()
-    grouped["Population_Range"] = grouped.apply(
-        lambda row: f"{row['min']}" if row["min"] == row["max"]
-        else f"{row['min']}-{row['max']}", axis=1
+    # Population ranges for each sample size, solved directly from the formula
+    grouped = calculate_sample_size_ranges(n_0, POP_MAX_ALL)
+    range_min = grouped["min"].astype(str)
+    range_max = grouped["max"].astype(str)
+    grouped["Population_Range"] = np.where(
+        grouped["min"] == grouped["max"], range_min, range_min + "-" + range_max
     )
     grouped = grouped[["Sample_Size", "Population_Range"]]
 
@@ -563,7 +662,7 @@ for scenario in scenarios_to_run:
     scenario["PostHocPythonCode"] = post_hoc_full_code
 
     # Save summary info
-    max_sample = df["Sample_Size"].max()
+    max_sample = grouped["Sample_Size"].max()
     scenario_summary.append({
         "Scenario": name,
         "Z-Score": z,
@@ -573,22 +672,37 @@ for scenario in scenarios_to_run:
     })
 
     # Save plot-specific data
-    temp = df[df["Population_Size"].between(POP_MIN, POP_MAX)].copy()
-    temp["Scenario"] = name
-    temp["LineStyle"] = scenario["LineStyle"]
-    temp["LineColor"] = scenario["LineColor"]
-    plot_df = pd.concat([plot_df, temp], ignore_index=True)
+    df["Scenario"] = name
+    df["LineStyle"] = scenario["LineStyle"]
+    df["LineColor"] = scenario["LineColor"]
+    plot_frames.append(df)
 
     # Save grouped range data for Excel
     scenario["DataFrame_Grouped"] = grouped
     scenario["DataFrame_PostHoc"] = post_hoc_grouped
 
+# Combine plot data once rather than growing a DataFrame inside the loop
+plot_df = pd.concat(plot_frames, ignore_index=True)
+
 # =============================================================================
 # SECTION 7: Create Line Graph
 # =============================================================================
 
+def save_graph(fig, path):
+    """
+    Render a figure to PNG once, write it to the images folder, and return
+    the in-memory image for embedding in the Excel workbook.
+    """
+    image_data = io.BytesIO()
+    fig.savefig(image_data, format='png', dpi=GRAPH_DPI, bbox_inches='tight')
+    with open(path, 'wb') as f:
+        f.write(image_data.getvalue())
+    image_data.seek(0)
+    return image_data
+
 print("▶ Creating combined line graph...")
-plt.figure(figsize=(10, 6))
+fig, ax = plt.subplots(figsize=(10, 6))
+scenario_lines = {}
 
 for scenario in scenarios_to_run:
     temp = plot_df[plot_df["Scenario"] == scenario["Name"]]
@@ -596,32 +710,54 @@ for scenario in scenarios_to_run:
     # Use pre-calculated values for consistency
     label = f"±{scenario['MarginPct']}%, CL={scenario['ConfidencePct']}%"
 
-    # Plot each scenario
-    plt.plot(
+    # Plot each scenario once; the per-scenario graphs below reuse these lines
+    scenario_lines[scenario["Name"]], = ax.plot(
         temp["Population_Size"],
-        temp["Truncated_Sample_Size"],
+        np.minimum(temp["Sample_Size"].values, SAMPLE_CAP),
         label=label,
         linestyle=scenario["LineStyle"],
         color=scenario["LineColor"],
         linewidth=1.5
     )
 
-plt.xlabel("Population Size")
-plt.ylabel(f"Sample Size")
-plt.title("Sample Size vs Population Size")
-plt.xticks(range(X_TICK_START, POP_MAX + 1, X_TICK_INTERVAL))
-plt.yticks(range(0, SAMPLE_CAP+1, Y_TICK_INTERVAL))
-plt.ylim(0, SAMPLE_CAP)
-plt.xlim(POP_MIN, POP_MAX)
-plt.grid(True, alpha=0.3)
-plt.legend(loc='upper right')
-plt.tight_layout()
+ax.set_xlabel("Population Size")
+ax.set_ylabel(f"Sample Size")
+ax.set_title("Sample Size vs Population Size")
+ax.set_xticks(X_TICKS)
+ax.set_yticks(Y_TICKS)
+ax.set_ylim(0, SAMPLE_CAP)
+ax.set_xlim(POP_MIN, POP_MAX)
+ax.grid(True, alpha=0.3)
+ax.legend(loc='upper right')
+fig.tight_layout()
 
 # Save plot image
 graph_path = os.path.join(images_folder, "all_scenarios_plot.png")
-plt.savefig(graph_path, dpi=300, bbox_inches='tight')
+graph_image = save_graph(fig, graph_path)
 plt.show()
 
+# Scenario-specific graphs: show one line at a time on the same figure
+for line in scenario_lines.values():
+    line.set_linewidth(2)
+
+for scenario in scenarios_to_run:
+    scenario_name = scenario["Name"]
+    print(f"▶ Generating graph for {scenario_name}...")
+
+    for line_name, line in scenario_lines.items():
+        line.set_visible(line_name == scenario_name)
+
+    ax.set_title(f"Sample Size vs Population Size\n{scenario_name}")
+    ax.legend([scenario_lines[scenario_name]], [scenario_name], loc='upper right')
+    fig.tight_layout()
+
+    # Save unique graph for this scenario
+    graph_filename = f"scenario_{scenario['Letter']}_plot.png"
+    scenario["GraphPath"] = os.path.join(images_folder, graph_filename)
+    scenario["GraphImage"] = save_graph(fig, scenario["GraphPath"])
+
+plt.close(fig)
+
 # =============================================================================
 # SECTION 8: Export to Excel with Separate Python Code Sheets AND Post Hoc Tables
 # =============================================================================
@@ -631,7 +767,24 @@ excel_filename = "Sample_Size_Tables_Graphs.xlsx"
 excel_path = os.path.join(output_folder_path, excel_filename)
 summary_df = pd.DataFrame(scenario_summary)
 
-with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
+def write_table(worksheet, df, header_format):
+    """
+    Write a DataFrame to a worksheet in row order, header first.
+
+    The workbook uses constant_memory mode, which flushes each row to disk as
+    soon as a later row is started. DataFrame.to_excel writes column by column,
+    so it cannot be used here without losing cells.
+    """
+    worksheet.write_row(0, 0, df.columns.tolist(), header_format)
+
+    for row_num, row in enumerate(df.values.tolist(), start=1):
+        worksheet.write_row(row_num, 0, row)
+
+with pd.ExcelWriter(
+    excel_path,
+    engine='xlsxwriter',
+    engine_kwargs={'options': {'constant_memory': True}}
+) as writer:
     workbook = writer.book
 
     # Define formats
@@ -660,17 +813,17 @@ with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
         'valign': 'vcenter'
     })
 
+    # Formats for post hoc table notes (shared across scenarios)
+    census_note_format = workbook.add_format({'italic': True, 'font_size': 10})
+    rules_title_format = workbook.add_format({'bold': True, 'font_size': 11})
+
     # Sheet 1: Scenario Summary + All-Scenario Graph
-    summary_df.to_excel(writer, sheet_name="Scenario Summary", index=False)
-    summary_ws = writer.sheets["Scenario Summary"]
+    summary_ws = workbook.add_worksheet("Scenario Summary")
     summary_ws.set_column('A:E', 22)
+    write_table(summary_ws, summary_df, header_format)
 
-    # Apply header format to Scenario Summary
-    for col_num, value in enumerate(summary_df.columns.values):
-        summary_ws.write(0, col_num, value, header_format)
-
-    if os.path.exists(graph_path):
-        summary_ws.insert_image("A7", graph_path, {"x_scale": 0.8, "y_scale": 0.8})
+    summary_ws.insert_image("A7", os.path.basename(graph_path),
+                            {"x_scale": 0.8, "y_scale": 0.8, "image_data": graph_image})
 
     # Create individual sheets for each scenario (data sheet + python sheet + post hoc table)
     for scenario in scenarios_to_run:
@@ -681,46 +834,13 @@ with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
         python_code = scenario["PythonCode"]
         post_hoc_python_code = scenario["PostHocPythonCode"]
 
-        # Create scenario-specific graph
-        print(f"▶ Generating graph for {scenario_name}...")
-        plt.figure(figsize=(10, 6))
-        temp = plot_df[plot_df["Scenario"] == scenario_name]
-        plt.plot(
-            temp["Population_Size"],
-            temp["Truncated_Sample_Size"],
-            label=scenario_name,
-            linestyle=scenario["LineStyle"],
-            color=scenario["LineColor"],
-            linewidth=2
-        )
-        plt.xlabel("Population Size")
-        plt.ylabel(f"Sample Size")
-        plt.title(f"Sample Size vs Population Size\n{scenario_name}")
-        plt.xticks(range(X_TICK_START, POP_MAX + 1, X_TICK_INTERVAL))
-        plt.yticks(range(0, SAMPLE_CAP + 1, Y_TICK_INTERVAL))
-        plt.ylim(0, SAMPLE_CAP)
-        plt.xlim(POP_MIN, POP_MAX)
-        plt.grid(True, alpha=0.3)
-        plt.legend(loc='upper right')
-        plt.tight_layout()
-
-        # Save unique graph for this scenario
-        graph_filename = f"scenario_{scenario_letter}_plot.png"
-        graph_path_scenario = os.path.join(images_folder, graph_filename)
-        plt.savefig(graph_path_scenario, dpi=300, bbox_inches='tight')
-        plt.close()
-
         # Sheet: Scenario Data and Graph (Original)
-        grouped.to_excel(writer, sheet_name=scenario_name, index=False)
-        ws = writer.sheets[scenario_name]
+        ws = workbook.add_worksheet(scenario_name)
         ws.set_column('A:B', 25)
+        write_table(ws, grouped, header_format)
 
-        # Apply header format
-        for col_num, value in enumerate(grouped.columns.values):
-            ws.write(0, col_num, value, header_format)
-
-        if os.path.exists(graph_path_scenario):
-            ws.insert_image("C2", graph_path_scenario, {"x_scale": 0.8, "y_scale": 0.8})
+        ws.insert_image("C2", os.path.basename(scenario["GraphPath"]),
+                        {"x_scale": 0.8, "y_scale": 0.8, "image_data": scenario["GraphImage"]})
 
         # Sheet: Python Code for this scenario (Original)
         code_sheet_name = f"Scenario {scenario_letter} (Python)"
@@ -738,21 +858,17 @@ with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
 
         # NEW: Sheet for Post Hoc Table
         post_hoc_sheet_name = f"Scenario {scenario_letter} (Post Hoc Table)"
-        post_hoc_grouped.to_excel(writer, sheet_name=post_hoc_sheet_name, index=False)
-        post_hoc_ws = writer.sheets[post_hoc_sheet_name]
+        post_hoc_ws = workbook.add_worksheet(post_hoc_sheet_name)
         post_hoc_ws.set_column('A:B', 25)
-
-        # Apply post hoc header format
-        for col_num, value in enumerate(post_hoc_grouped.columns.values):
-            post_hoc_ws.write(0, col_num, value, posthoc_header_format)
+        write_table(post_hoc_ws, post_hoc_grouped, posthoc_header_format)
 
         # Add explanation note
         post_hoc_ws.write(len(post_hoc_grouped) + 2, 0, "* Indicates full census — entire population must be selected.",
-                         workbook.add_format({'italic': True, 'font_size': 10}))
+                         census_note_format)
 
         # Add transformation notes
         post_hoc_ws.write(len(post_hoc_grouped) + 4, 0, "Post Hoc Table Rules Applied:",
-                         workbook.add_format({'bold': True, 'font_size': 11}))
+                         rules_title_format)
         post_hoc_ws.write(len(post_hoc_grouped) + 5, 0, "• Odd-numbered sample sizes merged downward to even-numbered sizes")
         post_hoc_ws.write(len(post_hoc_grouped) + 6, 0, "• Population ranges expanded through systematic consolidation")
         post_hoc_ws.write(len(post_hoc_grouped) + 7, 0, "• Maintains logical coherence (sample size ≤ population size)")